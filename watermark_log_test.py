@@ -1,9 +1,18 @@
 import os
+import sys
 import time
 import random
 from pathlib import Path
-from collections import defaultdict
+from collections import deque
+from functools import lru_cache
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+
+# Works with stock Pillow. For faster pixel work (e.g. convert("RGB")) on CPUs
+# with SSE4/AVX2, Pillow-SIMD can be swapped in as a drop-in replacement:
+#   pip uninstall pillow && pip install pillow-simd
+# (JPEG decode/encode already use libjpeg-turbo's SIMD code either way)
 from PIL import Image, ImageDraw, ImageFont
 
 # --- CONFIGURATION ---
@@ -14,6 +23,7 @@ LOGS_DIR = ROOT_DIR / "Logs"
 
 # Image types to process
 IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+IMAGE_EXT_SET = {ext.lstrip(".").lower() for ext in IMAGE_EXTS}  # lookup form
 
 # Optional: path to a TTF font file you like
 # For example: r"C:\Windows\Fonts\arial.ttf"
@@ -24,12 +34,28 @@ TEXT_COLOR = (255, 0, 0)      # R,G,B (red)
 MARGIN_RATIO = 0.02           # 2% of image width as margin
 FONT_SIZE_RATIO = 0.04        # 4% of image height as font size
 
+# Output JPEG quality (1-95); JPEGs are also saved with optimized Huffman tables
+JPEG_QUALITY = 85
+
+# Optional: cap the output's longest side in pixels, e.g. 4096.
+# Larger images are scaled down to fit. Oversized JPEGs are first reduced by
+# libjpeg while decoding (1/2, 1/4 or 1/8), which is much cheaper than a
+# full-size decode. None keeps the original resolution.
+MAX_DIM = None
+
+# Camera stills can be very large; don't reject them as decompression bombs
+Image.MAX_IMAGE_PIXELS = None
+
 # Name of the output folder created next to each "stills" folder
 OUTPUT_FOLDER_NAME = "Stills With Pole Number"
 
 # Prefixes to ignore as "not a real pole ID" (case-insensitive)
 IGNORED_PREFIXES = {"noasset"}
 
+# Set WATERMARK_SILENT=1 to skip all the artificial delays below
+# (plain printing, no typewriter effect or pauses)
+SILENT = os.environ.get("WATERMARK_SILENT") == "1"
+
 # Artificial "UI" timing controls (pre-[Y/N] and headings)
 TYPE_DELAY = 0.005        # seconds per character for slow printing
 SCAN_BUFFER_MIN = 0.15    # min extra delay before each "Scanned stills..." line
@@ -45,17 +71,30 @@ POST_CONFIRM_DELAY_MAX = 1.0
 PER_IMAGE_DELAY_MIN = 0.0
 PER_IMAGE_DELAY_MAX = 0.0
 
+# Number of worker threads used to watermark images in parallel
+# (Pillow releases the GIL while decoding/encoding, so threads scale well)
+MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
 
 # --- SLOW PRINT HELPERS (used before [Y/N] + headings + summary) ---
 
 def slow_print(text="", end="\n", delay=TYPE_DELAY):
     """Print text character by character with a small delay."""
     s = str(text)
+    write = sys.stdout.write
+
+    # No animation: emit the whole line in one write + flush
+    if SILENT or delay <= 0:
+        write(s + end)
+        sys.stdout.flush()
+        return
+
     for ch in s:
-        print(ch, end="", flush=True)
-        if delay > 0:
-            time.sleep(delay)
-    print(end, end="", flush=True)
+        write(ch)
+        sys.stdout.flush()
+        time.sleep(delay)
+    write(end)
+    sys.stdout.flush()
 
 
 def slow_line(char, length):
@@ -65,23 +104,22 @@ def slow_line(char, length):
 
 # --- WATERMARK HELPERS ---
 
-def get_pole_id(filename):
+def get_pole_id(name):
     """
     Extract pole ID = everything before the first underscore.
+    Takes a bare file name (e.g. Path.name), not a full path.
 
     Examples:
         '603504_2025-11-25_xx.jpg'   -> '603504'
         'D825042_2025-11-25_xx.jpg'  -> 'D825042'
         'NoAsset_2025-11-25_xx.jpg' -> ignored (returns None)
     """
-    base = os.path.basename(filename)
+    first_part, sep, _ = name.partition("_")
 
     # Require an underscore so we don't try to use random names as IDs
-    if "_" not in base:
+    if not sep:
         return None
 
-    first_part = base.split("_", 1)[0]
-
     # Ignore certain known non-asset prefixes (case-insensitive)
     if first_part.lower() in IGNORED_PREFIXES:
         return None
@@ -90,8 +128,9 @@ def get_pole_id(filename):
     return first_part
 
 
-def load_font(img_height):
-    size = max(12, int(img_height * FONT_SIZE_RATIO))
+@lru_cache(maxsize=64)
+def load_font_cached(size):
+    """Load the watermark font at a given size (cached, most batches share one size)."""
     if FONT_PATH is not None and os.path.exists(FONT_PATH):
         return ImageFont.truetype(FONT_PATH, size=size)
     else:
@@ -102,51 +141,151 @@ def load_font(img_height):
             return ImageFont.load_default()
 
 
+def _save_options(path_out):
+    """Encoder options for an output file, based on its extension."""
+    if path_out.suffix.lower() in (".jpg", ".jpeg"):
+        return {"quality": JPEG_QUALITY, "optimize": True, "subsampling": "4:2:0"}
+    return {}
+
+
+# Shared 1x1 canvas used only to measure text
+_MEASURE_DRAW = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+@lru_cache(maxsize=4096)
+def text_bbox(text, size):
+    """Text box (left, top, right, bottom) relative to the draw origin (cached)."""
+    return _MEASURE_DRAW.textbbox((0, 0), text, font=load_font_cached(size))
+
+
+@lru_cache(maxsize=512)
+def render_text_tile(text, size):
+    """
+    Rasterize text once into an 'L' mask (cached per text/size).
+    The mask covers exactly text_bbox(text, size).
+    """
+    font = load_font_cached(size)
+    bbox = text_bbox(text, size)
+    width = max(1, bbox[2] - bbox[0])
+    height = max(1, bbox[3] - bbox[1])
+    mask = Image.new("L", (width, height), 0)
+    ImageDraw.Draw(mask).text((-bbox[0], -bbox[1]), text, font=font, fill=255)
+    return mask
+
+
 def watermark_image(path_in, path_out):
     """
-    Watermark a single image.
+    Watermark a single image. path_out's folder must already exist.
     Returns True if written, False if skipped (e.g. no usable pole ID).
     """
     pole_id = get_pole_id(path_in.name)
     if pole_id is None:
-        print(f"    Skipping {path_in.name}: no usable pole ID found.")
+        # Newline is part of the single write so parallel workers don't interleave
+        print(f"    Skipping {path_in.name}: no usable pole ID found.\n", end="", flush=True)
         return False
 
     with Image.open(path_in) as im:
+        if MAX_DIM and im.format == "JPEG" and max(im.size) > MAX_DIM:
+            # draft() keeps both sides >= the box, so size the box so the long
+            # side decides the scale
+            w, h = im.size
+            if w >= h:
+                im.draft("RGB", (MAX_DIM, max(1, MAX_DIM * h // w)))
+            else:
+                im.draft("RGB", (max(1, MAX_DIM * w // h), MAX_DIM))
+        # Decode once, right away, so the source file is closed before encoding
+        im.load()
+
+    if im.mode != "RGB":
         im = im.convert("RGB")
-        draw = ImageDraw.Draw(im)
 
-        font = load_font(im.height)
-        text = pole_id
+    # Finish the downscale so the long side is at most MAX_DIM
+    if MAX_DIM and max(im.size) > MAX_DIM:
+        im.thumbnail((MAX_DIM, MAX_DIM))
+
+    size = max(12, int(im.height * FONT_SIZE_RATIO))
+    bbox = text_bbox(pole_id, size)
+    mask = render_text_tile(pole_id, size)
+
+    # Text size and position (top-right)
+    text_w = bbox[2] - bbox[0]
+    margin = int(im.width * MARGIN_RATIO)
+    x = im.width - text_w - margin
+    y = margin
+
+    # Main red text (no outline), stamped from the pre-rendered mask
+    im.paste(TEXT_COLOR, (x + bbox[0], y + bbox[1]), mask)
+
+    # Honor per-image delay BEFORE saving & printing
+    if not SILENT and PER_IMAGE_DELAY_MAX > 0:
+        delay = random.uniform(PER_IMAGE_DELAY_MIN, PER_IMAGE_DELAY_MAX)
+        time.sleep(max(0.0, delay))
+
+    im.save(path_out, **_save_options(path_out))
+    print(f"    Saved {path_out.name}\n", end="", flush=True)
+    return True
 
-        # Text size and position (top-right) using textbbox (Pillow 10+)
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_w = bbox[2] - bbox[0]
-        text_h = bbox[3] - bbox[1]
-        margin = int(im.width * MARGIN_RATIO)
-        x = im.width - text_w - margin
-        y = margin
 
-        # Main red text (no outline)
-        draw.text((x, y), text, font=font, fill=TEXT_COLOR)
+def watermark_batch(executor, jobs, max_pending=None):
+    """
+    Run (path_in, path_out) jobs on the executor as a bounded work queue.
+    Jobs are pulled lazily, with at most max_pending in flight at once.
+    Yields (path_in, ok) in the same order as jobs, so results are stable
+    from run to run (workers still print as they finish).
+    """
+    if max_pending is None:
+        max_pending = MAX_WORKERS * 2
+
+    pending = deque()  # (path_in, future), oldest first
+    for path_in, path_out in jobs:
+        if len(pending) >= max_pending:
+            oldest_path, oldest = pending.popleft()
+            yield oldest_path, oldest.result()
+        pending.append((path_in, executor.submit(watermark_image, path_in, path_out)))
+
+    while pending:
+        path_in, future = pending.popleft()
+        yield path_in, future.result()
 
-        # Honor per-image delay BEFORE saving & printing
-        if PER_IMAGE_DELAY_MAX > 0:
-            delay = random.uniform(PER_IMAGE_DELAY_MIN, PER_IMAGE_DELAY_MAX)
-            time.sleep(max(0.0, delay))
 
-        path_out.parent.mkdir(parents=True, exist_ok=True)
-        im.save(path_out, quality=95)
-        print(f"    Saved {path_out.name}")
-        return True
+def _has_image_ext(name):
+    """True if a file name ends in one of IMAGE_EXTS (case-insensitive)."""
+    stem, dot, ext = name.rpartition(".")
+    return bool(dot and stem) and ext.lower() in IMAGE_EXT_SET
 
 
 def find_stills_folders(root):
     """Yield all folders named 'stills' (case-insensitive) under root."""
-    for dirpath, dirnames, filenames in os.walk(root):
-        for d in dirnames:
-            if d.lower() == "stills":
-                yield Path(dirpath) / d
+    # os.scandir reuses the directory entry type info, so no extra stat() per entry
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if not entry.is_dir():
+                        continue
+                    if entry.name.lower() == "stills":
+                        yield Path(entry.path)
+                    # Like os.walk: don't descend into symlinked folders
+                    if not entry.is_symlink():
+                        stack.append(entry.path)
+        except OSError:
+            # Unreadable folder: skip it, as os.walk did
+            continue
+
+
+def _rel(path, root=None):
+    """
+    Display string for path relative to root (default ROOT_DIR).
+    Plain string slicing, so no new Path objects like Path.relative_to.
+    """
+    root_str = str(ROOT_DIR if root is None else root)
+    s = str(path)
+    if s == root_str:
+        return "."
+    prefix = os.path.join(root_str, "")  # adds a trailing separator if missing
+    return s[len(prefix):] if s.startswith(prefix) else s
 
 
 def build_header_line(idx, total, stills_dir):
@@ -162,8 +301,8 @@ def build_header_line(idx, total, stills_dir):
     else:
         job_root_abs = ROOT_DIR
 
-    rel_parent = stills_dir.parent.relative_to(job_root_abs)
-    job_rel = job_root_abs.relative_to(ROOT_DIR)
+    rel_parent = _rel(stills_dir.parent, job_root_abs)
+    job_rel = _rel(job_root_abs)
     output_dir = stills_dir.parent / OUTPUT_FOLDER_NAME
 
     return (
@@ -172,16 +311,17 @@ def build_header_line(idx, total, stills_dir):
     )
 
 
-def write_log(job_stats, job_stills, folder_stats,
-              total_images, total_processed, conversion_time):
+def write_log(scanned, folder_stats,
+              total_images, total_processed, total_skipped, conversion_time):
     """
     Write a log file into ROOT_DIR/Logs.
     The log name is based on the job folder if there is only one.
+    scanned is main()'s sorted (job_root_abs, stills_dir, rel_path, image_files) list.
     Returns the Path to the log file.
     """
     LOGS_DIR.mkdir(exist_ok=True)
 
-    jobs_sorted = sorted(job_stats.keys(), key=lambda p: str(p))
+    jobs_sorted = list(dict.fromkeys(entry[0] for entry in scanned))
     now = datetime.now()
 
     if len(jobs_sorted) == 1:
@@ -192,47 +332,45 @@ def write_log(job_stats, job_stills, folder_stats,
 
     log_path = LOGS_DIR / log_filename
 
-    total_skipped = sum(stats["skipped"] for stats in folder_stats.values())
+    # Build the whole log in memory, then write it out in one go
+    parts = []
+    w = parts.append
+
+    w("Watermark Log\n")
+    w("=============\n")
+    w(f"Run time : {now:%Y-%m-%d %H:%M:%S}\n")
+    w(f"Root folder : {ROOT_DIR}\n\n")
+
+    w("Summary\n")
+    w("-------\n")
+    w(f"Total 'stills' folders with images: {len(folder_stats)}\n")
+    w(f"Total images found: {total_images}\n")
+    w(f"Total watermarked: {total_processed}\n")
+    w(f"Total skipped: {total_skipped}\n")
+    w(
+        f"Conversion time (seconds, excluding pauses): {conversion_time:.2f}\n\n"
+    )
 
-    with open(log_path, "w", encoding="utf-8") as f:
-        f.write("Watermark Log\n")
-        f.write("=============\n")
-        f.write(f"Run time : {now:%Y-%m-%d %H:%M:%S}\n")
-        f.write(f"Root folder : {ROOT_DIR}\n\n")
-
-        f.write("Summary\n")
-        f.write("-------\n")
-        f.write(f"Total 'stills' folders with images: {len(folder_stats)}\n")
-        f.write(f"Total images found: {total_images}\n")
-        f.write(f"Total watermarked: {total_processed}\n")
-        f.write(f"Total skipped: {total_skipped}\n")
-        f.write(
-            f"Conversion time (seconds, excluding pauses): {conversion_time:.2f}\n\n"
-        )
+    w("Per-folder details\n")
+    w("------------------\n")
 
-        f.write("Per-folder details\n")
-        f.write("------------------\n")
+    for idx, (_, stills_dir, rel_path, _) in enumerate(scanned, start=1):
+        stats = folder_stats[stills_dir]
 
-        idx = 1
-        for job_root_abs in jobs_sorted:
-            for stills_dir in sorted(job_stills[job_root_abs], key=lambda p: str(p)):
-                if stills_dir not in folder_stats:
-                    continue
-                stats = folder_stats[stills_dir]
-                rel_path = stills_dir.relative_to(ROOT_DIR)
+        w(f"[{idx}] {rel_path}\n")
+        w(f"    Images found : {stats['found']}\n")
+        w(f"    Watermarked  : {stats['watermarked']}\n")
+        w(f"    Skipped      : {stats['skipped']}\n")
 
-                f.write(f"[{idx}] {rel_path}\n")
-                f.write(f"    Images found : {stats['found']}\n")
-                f.write(f"    Watermarked  : {stats['watermarked']}\n")
-                f.write(f"    Skipped      : {stats['skipped']}\n")
+        if stats["skipped_files"]:
+            w("    Skipped files:\n")
+            for name in stats["skipped_files"]:
+                w(f"        {name}\n")
 
-                if stats["skipped_files"]:
-                    f.write("    Skipped files:\n")
-                    for name in stats["skipped_files"]:
-                        f.write(f"        {name}\n")
+        w("\n")
 
-                f.write("\n")
-                idx += 1
+    with open(log_path, "w", encoding="utf-8") as f:
+        f.write("".join(parts))
 
     return log_path
 
@@ -253,16 +391,15 @@ def main():
         slow_print("No 'stills' folders found under this directory.")
         return
 
-    # Stats grouped by top-level job folder (e.g. 'BALCLUTHA 25-11-25')
-    job_stills = defaultdict(list)   # job_root_abs -> [stills_dir]
-    per_stills_images = {}           # stills_dir -> [image_paths]
-    job_stats = {}                   # job_root_abs -> {"stills": int, "images": int}
-    folder_stats = {}                # stills_dir -> dict with found/watermarked/skipped
+    # One entry per stills folder with images:
+    # (job_root_abs, stills_dir, rel_path, image_files)
+    scanned = []
+    folder_stats = {}  # stills_dir -> dict with found/watermarked/skipped
 
     total_images = 0
 
     # Scan each stills folder for images (but don't watermark yet)
-    for stills_dir in sorted(stills_dirs, key=lambda p: str(p)):
+    for stills_dir in stills_dirs:
         rel_to_root = stills_dir.relative_to(ROOT_DIR)
 
         # Top-level folder under ROOT_DIR (job folder)
@@ -272,21 +409,18 @@ def main():
             job_root_abs = ROOT_DIR
 
         # All image files in this stills dir
-        image_files = [
-            f for f in stills_dir.iterdir()
-            if f.is_file() and f.suffix.lower() in IMAGE_EXTS
-        ]
-        per_stills_images[stills_dir] = image_files
+        with os.scandir(stills_dir) as it:
+            image_files = [
+                Path(entry.path) for entry in it
+                if entry.is_file() and _has_image_ext(entry.name)
+            ]
 
         count = len(image_files)
         total_images += count
 
-        # Only track stats if there is at least one image
+        # Only track folders with at least one image
         if count > 0:
-            job_stills[job_root_abs].append(stills_dir)
-            stats = job_stats.setdefault(job_root_abs, {"stills": 0, "images": 0})
-            stats["stills"] += 1
-            stats["images"] += count
+            scanned.append((job_root_abs, stills_dir, _rel(stills_dir), image_files))
 
             folder_stats[stills_dir] = {
                 "found": count,
@@ -295,34 +429,34 @@ def main():
                 "skipped_files": [],
             }
 
-    if not job_stats:
+    if not scanned:
         slow_print("No images found in any 'stills' folders.")
         return
 
+    # Sort once; everything below reuses this order (jobs, then stills, by path)
+    scanned.sort(key=lambda entry: (str(entry[0]), str(entry[1])))
+
     # High-level "Searched X folder, found:" blocks
-    for job_root_abs, stats in sorted(job_stats.items(), key=lambda x: str(x[0])):
-        job_rel = job_root_abs.relative_to(ROOT_DIR)
+    for job_root_abs, entries in groupby(scanned, key=lambda entry: entry[0]):
+        job_rel = _rel(job_root_abs)
         slow_print(f"Searched \"{job_rel}\" folder, found:")
-        for stills_dir in sorted(job_stills[job_root_abs], key=lambda p: str(p)):
-            path_rel = stills_dir.relative_to(ROOT_DIR)
+        for _, _, path_rel, _ in entries:
             slow_print(f"  - {path_rel}")
         slow_print()
 
     # Detailed per-stills scan lines (only for folders with images)
     scan_messages = []
-    for job_root_abs in sorted(job_stats.keys(), key=lambda p: str(p)):
-        for stills_dir in sorted(job_stills[job_root_abs], key=lambda p: str(p)):
-            path_rel = stills_dir.relative_to(ROOT_DIR)
-            count = len(per_stills_images[stills_dir])
-            msg = f"Scanned stills folder inside {path_rel}, found {count} image(s)."
-            scan_messages.append(msg)
+    for _, _, path_rel, image_files in scanned:
+        count = len(image_files)
+        msg = f"Scanned stills folder inside {path_rel}, found {count} image(s)."
+        scan_messages.append(msg)
 
     if scan_messages:
         max_len = max(len(m) for m in scan_messages)
         slow_line("-", max_len)
         for m in scan_messages:
             # Small random buffer before each "found X image(s)" line
-            if SCAN_BUFFER_MAX > 0:
+            if not SILENT and SCAN_BUFFER_MAX > 0:
                 delay = random.uniform(SCAN_BUFFER_MIN, SCAN_BUFFER_MAX)
                 time.sleep(max(0.0, delay))
             slow_print(m)
@@ -339,7 +473,7 @@ def main():
     answer = input().strip().lower()
 
     # Small pause after the user answers (for both Y/y and N/n)
-    if POST_CONFIRM_DELAY_MAX > 0:
+    if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
         delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
         time.sleep(max(0.0, delay))
 
@@ -360,16 +494,12 @@ def main():
     slow_print()  # blank line
 
     # First pause after confirmation, before the first [1/N] line
-    if POST_CONFIRM_DELAY_MAX > 0:
+    if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
         delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
         time.sleep(max(0.0, delay))
 
     # Only iterate over folders that actually have images
-    stills_with_images = []
-    for job_root_abs in sorted(job_stats.keys(), key=lambda p: str(p)):
-        stills_with_images.extend(sorted(job_stills[job_root_abs], key=lambda p: str(p)))
-
-    num_stills_dirs = len(stills_with_images)
+    num_stills_dirs = len(scanned)
 
     if num_stills_dirs == 0:
         slow_print("Nothing to do. No 'stills' folders with images.")
@@ -378,56 +508,65 @@ def main():
     # --- HEADERS + CONVERSION-TIME MEASUREMENT ---
 
     # Print first header before starting conversions
-    first_stills = stills_with_images[0]
+    first_stills = scanned[0][1]
     first_header = build_header_line(1, num_stills_dirs, first_stills)
     slow_print(first_header)
-    if POST_CONFIRM_DELAY_MAX > 0:
+    if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
         delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
         time.sleep(max(0.0, delay))
 
     total_processed = 0
+    total_skipped = 0
     conversion_time = 0.0  # only time spent inside the image loops
 
-    for idx, stills_dir in enumerate(stills_with_images, start=1):
-        image_files = per_stills_images[stills_dir]
-        output_dir = stills_dir.parent / OUTPUT_FOLDER_NAME
-        stats = folder_stats[stills_dir]
-
-        # Conversion batch timing for this stills folder
-        batch_start = time.perf_counter()
-        for img_path in image_files:
-            out_path = output_dir / img_path.name
-            if watermark_image(img_path, out_path):
-                total_processed += 1
-                stats["watermarked"] += 1
-            else:
-                stats["skipped"] += 1
-                stats["skipped_files"].append(img_path.name)
-        batch_end = time.perf_counter()
-        conversion_time += (batch_end - batch_start)
-
-        print()  # blank line after this folder's images
-
-        # If there is another stills folder, do the "pause + header + pause" drama
-        if idx < num_stills_dirs:
-            next_dir = stills_with_images[idx]  # zero-based index
-            next_header = build_header_line(idx + 1, num_stills_dirs, next_dir)
-
-            # Pause after the last ".jpg"
-            if POST_CONFIRM_DELAY_MAX > 0:
-                delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
-                time.sleep(max(0.0, delay))
-
-            # Typewriter for next [i/n] header
-            slow_print(next_header)
+    # One pool for the whole run; each stills folder is fanned out across it
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        for idx, (_, stills_dir, _, image_files) in enumerate(scanned, start=1):
+            output_dir = stills_dir.parent / OUTPUT_FOLDER_NAME
+            # Create the output folder once, and only if something will be saved in it
+            # (same "is None" skip rule as watermark_image; '' is a valid ID here)
+            if any(get_pole_id(p.name) is not None for p in image_files):
+                output_dir.mkdir(parents=True, exist_ok=True)
+            stats = folder_stats[stills_dir]
 
-            # Second pause before actually starting next batch
-            if POST_CONFIRM_DELAY_MAX > 0:
-                delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
-                time.sleep(max(0.0, delay))
+            # Conversion batch timing for this stills folder
+            batch_start = time.perf_counter()
+            jobs = ((img_path, output_dir / img_path.name) for img_path in image_files)
+            # Results come back in image_files order, so the log's skipped list
+            # is the same on every run no matter which worker finishes first
+            for img_path, ok in watermark_batch(executor, jobs):
+                if ok:
+                    total_processed += 1
+                    stats["watermarked"] += 1
+                else:
+                    total_skipped += 1
+                    stats["skipped"] += 1
+                    stats["skipped_files"].append(img_path.name)
+            batch_end = time.perf_counter()
+            conversion_time += (batch_end - batch_start)
+
+            print()  # blank line after this folder's images
+
+            # If there is another stills folder, do the "pause + header + pause" drama
+            if idx < num_stills_dirs:
+                next_dir = scanned[idx][1]  # zero-based index
+                next_header = build_header_line(idx + 1, num_stills_dirs, next_dir)
+
+                # Pause after the last ".jpg"
+                if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
+                    delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
+                    time.sleep(max(0.0, delay))
+
+                # Typewriter for next [i/n] header
+                slow_print(next_header)
+
+                # Second pause before actually starting next batch
+                if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
+                    delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
+                    time.sleep(max(0.0, delay))
 
     # Pause after last ".jpg" line before summary (does not affect conversion_time)
-    if POST_CONFIRM_DELAY_MAX > 0:
+    if not SILENT and POST_CONFIRM_DELAY_MAX > 0:
         delay = random.uniform(POST_CONFIRM_DELAY_MIN, POST_CONFIRM_DELAY_MAX)
         time.sleep(max(0.0, delay))
 
@@ -447,17 +586,13 @@ def main():
     # Per-folder summary lines like:
     # BALCLUTHA...\stills: watermarked X of Y images.
     per_folder_lines = []
-    for job_root_abs in sorted(job_stats.keys(), key=lambda p: str(p)):
-        for stills_dir in sorted(job_stills[job_root_abs], key=lambda p: str(p)):
-            if stills_dir not in folder_stats:
-                continue
-            stats = folder_stats[stills_dir]
-            rel_path = stills_dir.relative_to(ROOT_DIR)
-            line = (
-                f"{rel_path}: watermarked "
-                f"{stats['watermarked']} of {stats['found']} images."
-            )
-            per_folder_lines.append(line)
+    for _, stills_dir, rel_path, _ in scanned:
+        stats = folder_stats[stills_dir]
+        line = (
+            f"{rel_path}: watermarked "
+            f"{stats['watermarked']} of {stats['found']} images."
+        )
+        per_folder_lines.append(line)
 
     # Top line length: longest of summary1 + per-folder lines
     all_for_top = [summary1] + per_folder_lines
@@ -475,15 +610,15 @@ def main():
     # --- WRITE LOG FILE ---
 
     log_path = write_log(
-        job_stats=job_stats,
-        job_stills=job_stills,
+        scanned=scanned,
         folder_stats=folder_stats,
         total_images=total_images,
         total_processed=total_processed,
+        total_skipped=total_skipped,
         conversion_time=conversion_time,
     )
 
-    rel_log = log_path.relative_to(ROOT_DIR)
+    rel_log = _rel(log_path)
     slow_print(f"Log written to '{rel_log}'.")
 
 